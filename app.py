@@ -5,8 +5,24 @@ from pathlib import Path
 import os
 import plotly.express as px
 import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 
-pd.options.mode.chained_assignment = None  # default='warn'
+try:
+    from tsdownsample import MinMaxLTTBDownsampler
+except ImportError:
+    MinMaxLTTBDownsampler = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = None
+    pacsv = None
+
+# Copy-on-Write: las asignaciones de columnas son intercambios de punteros
+# en vez de copias de bloques, y elimina la ambigüedad que el antiguo
+# chained_assignment=None solo silenciaba
+pd.set_option("mode.copy_on_write", True)
 
 # Configuración de la página
 st.set_page_config(
@@ -28,51 +44,156 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
+def _first_file(data_dir, suffix):
+    """
+    Primer archivo del directorio con el sufijo dado, o None.
+    Corta el escaneo en la primera coincidencia en vez de materializar
+    todos los matches como hace list(Path.glob(...)).
+    """
+    try:
+        with os.scandir(data_dir) as entries:
+            return next(
+                (Path(entry.path) for entry in entries
+                 if entry.name.endswith(suffix) and entry.is_file()),
+                None,
+            )
+    except FileNotFoundError:
+        return None
+
+
+def _read_cached_parquet(csv_path, cache_path):
+    """
+    Devuelve el DataFrame desde el caché Parquet si está actualizado
+    respecto al CSV original, o None si hay que re-parsear.
+    """
+    try:
+        if cache_path.exists() and cache_path.stat().st_mtime >= csv_path.stat().st_mtime:
+            return pd.read_parquet(cache_path, engine="pyarrow")
+    except Exception:
+        # Caché corrupto o pyarrow no disponible: volver al CSV
+        pass
+    return None
+
+
+def _write_cached_parquet(df, cache_path):
+    """
+    Guarda el DataFrame en Parquet de forma atómica (escribir a un
+    temporal y renombrar) para que dos sesiones no lean escrituras a medias.
+    """
+    try:
+        tmp_path = cache_path.with_suffix(".tmp")
+        df.to_parquet(tmp_path, engine="pyarrow", compression="zstd")
+        os.replace(tmp_path, cache_path)
+    except Exception:
+        # Sin pyarrow o sin permisos de escritura: seguir sin caché
+        pass
+
+
 # Función para cargar datos
-@st.cache_data(ttl=3600)  # Caché por 1 hora
+# persist="disk" hace que el caché sobreviva reinicios del proceso:
+# tras un reinicio la carga queda en una lectura de caché, no en re-parsear
+@st.cache_data(ttl=3600, persist="disk", show_spinner=False)
 def load_data():
     """
     Carga los datos desde la carpeta data/.
     Intenta primero con CSV, luego con JSON si es necesario.
+    El CSV se convierte una sola vez a Parquet y las cargas siguientes
+    leen ese caché (mucho más rápido que re-parsear el texto).
     """
     data_dir = Path("data")
-    
+
     try:
         # Buscar archivos CSV primero
-        csv_files = list(data_dir.glob("*.csv"))
-        if csv_files:
-            # Leer el CSV con manejo de codificación
-            df = pd.read_csv(csv_files[0], sep=';', encoding='utf-8')
-            
+        csv_path = _first_file(data_dir, ".csv")
+        if csv_path:
+            # Si ya existe un Parquet más reciente que el CSV, usarlo
+            # directamente (los dtypes ya vienen convertidos)
+            cache_path = data_dir / ".cache.parquet"
+            df_cached = _read_cached_parquet(csv_path, cache_path)
+            if df_cached is not None:
+                return df_cached
+
+            if pacsv is not None:
+                # Parser C++ multihilo de Arrow: convierte fechas y números
+                # durante la propia lectura, sin pasadas posteriores
+                table = pacsv.read_csv(
+                    csv_path,
+                    parse_options=pacsv.ParseOptions(delimiter=';'),
+                    convert_options=pacsv.ConvertOptions(
+                        timestamp_parsers=['%Y-%m-%d %H:%M:%S', '%Y-%m-%d'],
+                        # Campos vacíos como nulos (no ''), igual que pd.read_csv,
+                        # para que ambos lectores produzcan el mismo frame
+                        strings_can_be_null=True,
+                    ),
+                )
+                # Columnas completamente vacías: Arrow las tipa como null y
+                # to_pandas() las deja en object, con lo que el barrido de
+                # strings las rellenaría. Castearlas a float64 para coincidir
+                # con la inferencia de pd.read_csv (columna de NaN)
+                for i, field in enumerate(table.schema):
+                    if pa.types.is_null(field.type):
+                        table = table.set_column(
+                            i, field.name, table.column(i).cast(pa.float64())
+                        )
+                df = table.to_pandas()
+            else:
+                # Leer el CSV con manejo de codificación
+                df = pd.read_csv(csv_path, sep=';', encoding='utf-8')
+
             # Limpiar nombres de columnas
             df.columns = df.columns.str.strip()
-            
+
             # Asegurar que las columnas numéricas sean numéricas
-            if 'Duración' in df.columns:
+            # (con Arrow ya vienen convertidas; el chequeo evita la pasada extra)
+            if 'Duración' in df.columns and not pd.api.types.is_numeric_dtype(df['Duración']):
                 df['Duración'] = pd.to_numeric(df['Duración'], errors='coerce')
-            
-            # Convertir la columna de fecha y ordenar
+
+            # Convertir la columna de fecha y ordenar.
+            # El CSV trae fechas ISO ('2025-10-02 00:00:00'); fijar el formato
+            # usa el parser C vectorizado en vez de dateutil fila por fila
             if 'Fecha Límite' in df.columns:
-                df['Fecha Límite'] = pd.to_datetime(df['Fecha Límite'], errors='coerce')
+                if not pd.api.types.is_datetime64_any_dtype(df['Fecha Límite']):
+                    df['Fecha Límite'] = pd.to_datetime(
+                        df['Fecha Límite'], format='ISO8601', errors='coerce', cache=True
+                    )
                 df = df.sort_values('Fecha Límite')
             
-            # Rellenar valores NaN
+            # Usar strings respaldadas por pyarrow en vez de object:
+            # menos memoria y operaciones .str / value_counts mucho más rápidas.
+            # A propósito NO se usa astype('category'): value_counts/groupby
+            # sobre Categorical de pandas puede ser muchísimo más lento, y el
+            # diccionario de Arrow ya da el mismo ahorro de memoria sin eso
             for col in df.select_dtypes(include=['object']):
-                df[col] = df[col].fillna('No especificado')
-            
-            # Limpiar espacios en blanco en columnas de texto
-            for col in df.select_dtypes(include=['object']):
-                df[col] = df[col].str.strip()
-            
+                df[col] = df[col].astype('string[pyarrow]')
+
+            # Limpiar espacios y rellenar NaN en una sola pasada por columna,
+            # asignando todas las columnas de una vez
+            text_cols = df.select_dtypes(include=['string']).columns
+            df = df.assign(**{
+                col: df[col].str.strip().fillna('No especificado')
+                for col in text_cols
+            })
+
+            # Guardar el resultado ya limpio para las próximas cargas
+            _write_cached_parquet(df, cache_path)
+
             return df
     except Exception as e:
         st.error(f"Error al cargar el archivo: {str(e)}")
         return pd.DataFrame()
     
     # Si no hay CSV, buscar JSON
-    json_files = list(data_dir.glob("*.json"))
-    if json_files:
-        return pd.read_json(json_files[0])
+    json_path = _first_file(data_dir, ".json")
+    if json_path:
+        df = pd.read_json(json_path)
+        # read_json no infiere fechas para esta columna: convertirla aquí
+        # para que todo frame devuelto cumpla el mismo contrato de dtypes
+        if 'Fecha Límite' in df.columns:
+            if not pd.api.types.is_datetime64_any_dtype(df['Fecha Límite']):
+                df['Fecha Límite'] = pd.to_datetime(df['Fecha Límite'], errors='coerce')
+            # Mantener la garantía de orden de la que depende la línea temporal
+            df = df.sort_values('Fecha Límite')
+        return df
     
     # Si no hay datos, usar datos de ejemplo
     return pd.DataFrame({
@@ -82,10 +203,72 @@ def load_data():
         'region': np.random.choice(['Norte', 'Sur', 'Este', 'Oeste'], 365),
     })
 
-def get_kpi_metrics(df):
+def downsample_for_plot(df, x_col, y_col, n_out=2000):
+    """
+    Reduce la serie temporal a ~n_out puntos antes de graficar.
+    Plotly serializa y renderiza cada fila que recibe, así que con
+    series grandes esto recorta la latencia sin cambiar la forma visual.
+    Usa MinMaxLTTB si tsdownsample está instalado; si no, un muestreo
+    uniforme simple.
+    """
+    if len(df) <= n_out:
+        return df
+
+    if MinMaxLTTBDownsampler is not None:
+        idx = MinMaxLTTBDownsampler().downsample(
+            df[x_col].astype('int64').to_numpy(),
+            df[y_col].to_numpy(dtype='float64'),
+            n_out=n_out,
+        )
+    else:
+        idx = np.linspace(0, len(df) - 1, n_out).astype(int)
+
+    return df.iloc[idx]
+
+
+def top_k_with_others(counts, k=5):
+    """
+    A partir de un value_counts, arma el DataFrame para el gráfico de
+    torta: las k categorías más frecuentes y el resto agrupado en
+    'Otros'. Una sola pasada, sin concat ni Series intermedias.
+    """
+    top = counts.iloc[:k]
+    names = top.index.to_numpy(dtype=object)
+    values = top.to_numpy()
+    if len(counts) > k:
+        names = np.concatenate([names, ['Otros']])
+        values = np.concatenate([values, [counts.iloc[k:].sum()]])
+    return pd.DataFrame({'Categoría': names, 'Cantidad': values})
+
+
+@st.cache_data(ttl=3600)
+def compute_value_counts(series):
+    """
+    Conteo de valores de una columna, cacheado para que los reruns
+    de Streamlit no repitan el escaneo completo. Recibe la Series para
+    que Streamlit solo hashee esa columna, no el frame entero.
+    """
+    return series.value_counts()
+
+
+def data_fingerprint(df):
     """
-    Calcula métricas clave (KPIs) del DataFrame
+    Clave de caché barata (forma del frame + mtime del CSV de origen)
+    para no hacer pasar el DataFrame completo por el hasher de Streamlit.
     """
+    csv_path = _first_file(Path("data"), ".csv")
+    mtime = csv_path.stat().st_mtime if csv_path else 0.0
+    return (df.shape, mtime)
+
+
+@st.cache_data(ttl=3600)
+def get_kpi_metrics(_df, fingerprint):
+    """
+    Calcula métricas clave (KPIs) del DataFrame.
+    Cacheado: los reruns por interacción con widgets no recalculan nada.
+    El frame llega como _df (sin hashear); fingerprint es la clave real.
+    """
+    df = _df
     kpis = []
     
     # Total de casos
@@ -97,10 +280,12 @@ def get_kpi_metrics(df):
         'help': 'Número total de casos en el sistema'
     })
     
-    # Métrica de Duración
+    # Métrica de Duración: reducciones numpy directas sobre el array,
+    # sin la sobrecarga por llamada de pandas (ddof=1 como Series.std)
     if 'Duración' in df.columns:
-        duracion_media = df['Duración'].mean()
-        duracion_std = df['Duración'].std()
+        duracion = df['Duración'].to_numpy(dtype='float64')
+        duracion_media = np.nanmean(duracion)
+        duracion_std = np.nanstd(duracion, ddof=1)
         kpis.append({
             'title': 'Duración Promedio',
             'value': f"{duracion_media:.1f}",
@@ -110,19 +295,28 @@ def get_kpi_metrics(df):
     
     # Próximos vencimientos (próximos 30 días)
     if 'Fecha Límite' in df.columns:
-        today = pd.Timestamp.now()
-        proximos = df[df['Fecha Límite'].between(today, today + pd.Timedelta(days=30))]
+        # Solo se necesita el conteo: comparar sobre el array datetime64
+        # evita materializar un sub-DataFrame (NaT compara como False)
+        fechas = df['Fecha Límite'].to_numpy(dtype='datetime64[ns]')
+        today = np.datetime64(pd.Timestamp.now())
+        limite = today + np.timedelta64(30, 'D')
+        proximos_count = int(np.count_nonzero((fechas >= today) & (fechas <= limite)))
         kpis.append({
             'title': 'Próximos Vencimientos',
-            'value': len(proximos),
+            'value': proximos_count,
             'delta': 'en los próximos 30 días',
             'help': 'Casos que vencen en los próximos 30 días'
         })
     
     # Top actuaciones
-    if 'Actuación' in df.columns:
-        top_actuacion = df['Actuación'].value_counts().iloc[0]
-        top_actuacion_nombre = df['Actuación'].value_counts().index[0]
+    if 'Actuación' in df.columns and len(df) > 0:
+        # factorize + bincount: una sola pasada sobre la columna en vez
+        # de ordenar un value_counts completo solo para tomar el primero
+        codes, uniques = pd.factorize(df['Actuación'])
+        counts = np.bincount(codes[codes >= 0])
+        top_idx = counts.argmax()
+        top_actuacion = int(counts[top_idx])
+        top_actuacion_nombre = uniques[top_idx]
         kpis.append({
             'title': 'Actuación más Común',
             'value': str(top_actuacion_nombre)[:20] + '...' if len(str(top_actuacion_nombre)) > 20 else str(top_actuacion_nombre),
@@ -143,23 +337,23 @@ try:
     st.subheader("Evolución Temporal")
     
     # Usar la columna Fecha Límite para la línea temporal
+    # (load_data ya la entrega como datetime, no hay que re-parsearla)
     date_col = 'Fecha Límite' if 'Fecha Límite' in df.columns else None
-    
-    # Asegurarse de que la fecha esté en formato datetime
-    if date_col:
-        df[date_col] = pd.to_datetime(df[date_col])
-    
+
     # Gráfico de línea temporal
     if date_col and 'Duración' in df.columns:
         # Calcular la media
         media_duracion = df['Duración'].mean()
-        
-        # Ordenar el DataFrame por fecha
-        df_sorted = df.sort_values(by=date_col)
-        
+
+        # load_data ya entrega el DataFrame ordenado por Fecha Límite,
+        # no hace falta volver a ordenarlo en cada rerun
+
+        # Reducir los puntos antes de entregárselos a Plotly
+        df_plot = downsample_for_plot(df, date_col, 'Duración')
+
         # Crear el gráfico base con la línea de duración
         fig_timeline = px.line(
-            df_sorted,
+            df_plot,
             x=date_col,
             y='Duración',
             title='Evolución de la Duración de Casos'
@@ -187,7 +381,7 @@ try:
     
     # Sección 2: Tarjetas de KPIs
     st.subheader("📊 Métricas Clave")
-    kpi_metrics = get_kpi_metrics(df)
+    kpi_metrics = get_kpi_metrics(df, data_fingerprint(df))
     
     # Crear filas de métricas con 4 tarjetas por fila
     cols = st.columns(4)
@@ -203,97 +397,67 @@ try:
     # Sección 3: Gráficos Detallados
     st.subheader("Análisis Detallado")
     
+    # Calcular una sola vez las columnas categóricas y sus conteos,
+    # en lugar de repetirlo dentro de cada sección
+    categorical_cols = df.select_dtypes(include=['object', 'string']).columns
+    vc_cache = {col: compute_value_counts(df[col]) for col in categorical_cols[:4]}
+
     col1, col2 = st.columns(2)
-    
+
     with col1:
         # Gráfico de barras
-        categorical_cols = df.select_dtypes(include=['object']).columns
         if len(categorical_cols) > 0:
             cat_col = categorical_cols[0]
             st.write(f"### Conteo de {cat_col}")
-            # Asegurar que no hay valores nulos antes de hacer value_counts
-            counts = df[cat_col].fillna('No especificado').value_counts()
-            st.write(pd.DataFrame({
-                'Categoría': counts.index,
-                'Cantidad': counts.values
-            }))
-        
-        # Gráfico de torta con top 5
-        if len(categorical_cols) > 1:
-            cat_col2 = categorical_cols[1]
-            # Obtener el conteo de valores
-            value_counts = df[cat_col2].value_counts()
-            
-            # Separar top 5 y agrupar el resto
-            top_5 = value_counts.head(5)
-            others = pd.Series({'Otros': value_counts[5:].sum()}) if len(value_counts) > 5 else pd.Series({})
-            
-            # Combinar top 5 y otros
-            final_counts = pd.concat([top_5, others])
-            
-            # Crear DataFrame para el gráfico
-            pie_data = pd.DataFrame({
-                'Categoría': final_counts.index,
-                'Cantidad': final_counts.values
-            })
-            
-            fig_pie = px.pie(
-                pie_data,
-                values='Cantidad',
-                names='Categoría',
-                title=f'Top 5 - {cat_col2}',
+            # Los nulos ya vienen rellenados desde load_data
+            counts = vc_cache[cat_col]
+            st.dataframe(
+                counts.rename_axis('Categoría').reset_index(name='Cantidad'),
+                hide_index=True,
+                use_container_width=True,
             )
-            
-            # Actualizar el diseño
-            fig_pie.update_traces(textposition='inside', textinfo='percent+label')
-            fig_pie.update_layout(
-                showlegend=True,
-                legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
-            )
-            
-            st.plotly_chart(fig_pie, use_container_width=True)
-    
+        
     with col2:
         # Segundo gráfico de barras
         if len(categorical_cols) > 2:
             cat_col3 = categorical_cols[2]
             st.write(f"### Conteo de {cat_col3}")
-            st.write(df[cat_col3].value_counts())
-        
-        # Segundo gráfico de torta con top 5
-        if len(categorical_cols) > 3:
-            cat_col4 = categorical_cols[3]
-            # Obtener el conteo de valores
-            value_counts = df[cat_col4].value_counts()
-            
-            # Separar top 5 y agrupar el resto
-            top_5 = value_counts.head(5)
-            others = pd.Series({'Otros': value_counts[5:].sum()}) if len(value_counts) > 5 else pd.Series({})
-            
-            # Combinar top 5 y otros
-            final_counts = pd.concat([top_5, others])
-            
-            # Crear DataFrame para el gráfico
-            pie_data = pd.DataFrame({
-                'Categoría': final_counts.index,
-                'Cantidad': final_counts.values
-            })
-            
-            fig_pie2 = px.pie(
-                pie_data,
-                values='Cantidad',
-                names='Categoría',
-                title=f'Top 5 - {cat_col4}',
+            st.dataframe(
+                vc_cache[cat_col3].rename_axis('Categoría').reset_index(name='Cantidad'),
+                hide_index=True,
+                use_container_width=True,
             )
-            
-            # Actualizar el diseño
-            fig_pie2.update_traces(textposition='inside', textinfo='percent+label')
-            fig_pie2.update_layout(
-                showlegend=True,
-                legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+
+    # Gráficos de torta: una sola figura con subplots en lugar de dos
+    # figuras separadas (una serialización y un solo render de Plotly.js)
+    pie_cols = [categorical_cols[i] for i in (1, 3) if len(categorical_cols) > i]
+    if pie_cols:
+        fig_pies = make_subplots(
+            rows=1,
+            cols=len(pie_cols),
+            specs=[[{'type': 'pie'}] * len(pie_cols)],
+            subplot_titles=[f'Top 5 - {col}' for col in pie_cols],
+        )
+        for i, col in enumerate(pie_cols, start=1):
+            pie_data = top_k_with_others(vc_cache[col])
+            fig_pies.add_trace(
+                go.Pie(
+                    labels=pie_data['Categoría'],
+                    values=pie_data['Cantidad'],
+                    textposition='inside',
+                    textinfo='percent+label',
+                ),
+                row=1,
+                col=i,
             )
-            
-            st.plotly_chart(fig_pie2, use_container_width=True)
+
+        # Actualizar el diseño
+        fig_pies.update_layout(
+            showlegend=True,
+            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+        )
+
+        st.plotly_chart(fig_pies, use_container_width=True)
 
 except Exception as e:
     st.error(f"Error al cargar o procesar los datos: {str(e)}")